@@ -0,0 +1,176 @@
+import hashlib
+import hmac
+import os
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+from urllib3.util.retry import Retry
+
+CHAPA_INITIALIZE_URL = "https://api.chapa.co/v1/transaction/initialize"
+CHAPA_VERIFY_URL = "https://api.chapa.co/v1/transaction/verify/{transaction_id}"
+
+# Timeout (connect, read) applied to every outbound Chapa call
+CHAPA_TIMEOUT = (3.05, 10)
+
+# Upper bound on how much of a Chapa response body is read into memory
+CHAPA_MAX_RESPONSE_BYTES = 64 * 1024
+
+# The secret key is a process-level constant, so headers are built once
+_CHAPA_SECRET_KEY = os.environ.get("CHAPA_SECRET_KEY")
+_CHAPA_HEADERS = (
+    {
+        "Authorization": f"Bearer {_CHAPA_SECRET_KEY}",
+        "Content-Type": "application/json",
+    }
+    if _CHAPA_SECRET_KEY
+    else None
+)
+
+# Secret used by Chapa to sign webhook payloads
+_CHAPA_WEBHOOK_SECRET = os.environ.get("CHAPA_WEBHOOK_SECRET")
+
+# Shared session so Chapa calls reuse pooled keep-alive connections
+_CHAPA_SESSION = requests.Session()
+_CHAPA_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=20,
+        pool_maxsize=50,
+        max_retries=Retry(
+            total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504]
+        ),
+    ),
+)
+if _CHAPA_HEADERS is not None:
+    _CHAPA_SESSION.headers.update(_CHAPA_HEADERS)
+
+
+class ChapaError(Exception):
+    """Raised when Chapa rejects a request or returns an unusable response."""
+
+
+class ChapaUnavailable(ChapaError):
+    """Raised when Chapa cannot be reached or keeps answering with errors."""
+
+
+class ChapaResponseTooLarge(ChapaUnavailable):
+    """
+    Raised when a Chapa response body exceeds CHAPA_MAX_RESPONSE_BYTES.
+    Treated as an upstream fault rather than a rejection of the payment.
+    """
+
+
+def _read_body(response):
+    """
+    Read at most CHAPA_MAX_RESPONSE_BYTES of a streamed response body.
+    """
+    # Reading raw bypasses requests' exception wrapping, so stalled or
+    # broken bodies surface as urllib3 errors here
+    try:
+        content = response.raw.read(
+            CHAPA_MAX_RESPONSE_BYTES + 1, decode_content=True
+        )
+    except Urllib3HTTPError as exc:
+        raise ChapaUnavailable("Could not read response from Chapa.") from exc
+    if len(content) > CHAPA_MAX_RESPONSE_BYTES:
+        raise ChapaResponseTooLarge("Response from Chapa is too large.")
+    return content
+
+
+def get_chapa_session():
+    """
+    Return the shared Chapa session, or None if the secret key is missing.
+    """
+    if _CHAPA_HEADERS is None:
+        return None
+    return _CHAPA_SESSION
+
+
+def is_valid_signature(body, signature):
+    """
+    Check a webhook signature: the hex HMAC-SHA256 of the raw body.
+    Always False when no webhook secret is configured.
+    """
+    if not _CHAPA_WEBHOOK_SECRET or not signature:
+        return False
+    expected = hmac.new(
+        _CHAPA_WEBHOOK_SECRET.encode(), body, hashlib.sha256
+    ).hexdigest()
+    return hmac.compare_digest(expected.encode(), signature.encode())
+
+
+def initialize_transaction(
+    session, tx_ref, amount, email, first_name, last_name, callback_url
+):
+    """
+    Initiate a Chapa transaction.
+    Returns a (transaction_id, checkout_url) tuple or raises ChapaError.
+    """
+    # Data expected by Chapa – adjust fields as per Chapa API docs.
+    data = {
+        "amount": str(amount),
+        "currency": "ETB",  # Change this to your required currency
+        "email": email,
+        "first_name": first_name,
+        "last_name": last_name,
+        "tx_ref": str(tx_ref),  # Use payment_id as transaction reference
+        "callback_url": callback_url,
+    }
+
+    # The session already sends Content-Type: application/json
+    try:
+        with session.post(
+            CHAPA_INITIALIZE_URL,
+            data=orjson.dumps(data),
+            stream=True,
+            timeout=CHAPA_TIMEOUT,
+        ) as response:
+            if response.status_code != 200:
+                raise ChapaError("Failed to initiate payment with Chapa.")
+            content = _read_body(response)
+    except requests.RequestException as exc:
+        raise ChapaUnavailable("Could not reach Chapa.") from exc
+
+    try:
+        res_data = orjson.loads(content)
+    except orjson.JSONDecodeError:
+        raise ChapaError("Invalid response from Chapa.")
+    if not isinstance(res_data, dict):
+        raise ChapaError("Invalid response from Chapa.")
+    # Extract transaction details (adjust keys based on Chapa’s response)
+    details = res_data.get("data") or {}
+    if not isinstance(details, dict):
+        raise ChapaError("Invalid response from Chapa.")
+    transaction_id = details.get("transaction_id")
+    checkout_url = details.get("checkout_url")
+    if not transaction_id or not checkout_url:
+        raise ChapaError("Invalid response from Chapa.")
+
+    return transaction_id, checkout_url
+
+
+def verify_transaction(session, transaction_id):
+    """
+    Fetch Chapa's verification result for a transaction.
+    Returns the decoded response body or raises ChapaError.
+    """
+    try:
+        with session.get(
+            CHAPA_VERIFY_URL.format(transaction_id=transaction_id),
+            stream=True,
+            timeout=CHAPA_TIMEOUT,
+        ) as response:
+            if response.status_code != 200:
+                raise ChapaError("Payment verification failed with Chapa.")
+            content = _read_body(response)
+    except requests.RequestException as exc:
+        raise ChapaUnavailable("Could not reach Chapa.") from exc
+
+    try:
+        res_data = orjson.loads(content)
+    except orjson.JSONDecodeError:
+        raise ChapaError("Payment verification failed with Chapa.")
+    if not isinstance(res_data, dict):
+        raise ChapaError("Payment verification failed with Chapa.")
+    return res_data
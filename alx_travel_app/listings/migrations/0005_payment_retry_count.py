@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-15 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0004_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='retry_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -56,6 +56,13 @@ class Booking(models.Model):
     def __str__(self):
         return f"Booking {self.booking_id} - {self.property.name}"
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["user", "status"], name="booking_user_status_idx"
+            ),
+        ]
+
 
 class Review(models.Model):
     """Model representing a property review"""
@@ -97,11 +104,13 @@ class Payment(models.Model):
     )
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     transaction_id = models.CharField(max_length=100, blank=True, null=True)
+    checkout_url = models.URLField(max_length=500, blank=True, null=True)
     status = models.CharField(
         max_length=20,
         choices=PaymentStatus.choices,
         default=PaymentStatus.PENDING,
     )
+    retry_count = models.PositiveSmallIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -109,3 +118,8 @@ class Payment(models.Model):
         return (
             f"Payment {self.payment_id} for Booking {self.booking.booking_id}"
         )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["transaction_id"], name="payment_txid_idx"),
+        ]
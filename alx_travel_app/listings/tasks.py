@@ -1,15 +1,58 @@
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
 from celery import shared_task
+from celery.exceptions import SoftTimeLimitExceeded
 from django.core.mail import send_mail
 from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .chapa import (
+    ChapaError,
+    ChapaUnavailable,
+    get_chapa_session,
+    initialize_transaction,
+    verify_transaction,
+)
+from .models import Booking, Payment
+
+# Failed verify attempts a pending payment may have before it is failed
+MAX_VERIFY_RETRIES = 4
+
+# Pending payments older than this are expired as failed
+PENDING_PAYMENT_MAX_AGE = timedelta(days=2)
+
+# Maximum number of payments verified per polling run
+PENDING_PAYMENT_BATCH_SIZE = 200
+
+# Seconds a polling run may take; kept under the 5 minute beat interval so
+# a slow run is stopped before the next one starts
+POLL_SOFT_TIME_LIMIT = 240
 
 
 @shared_task
-def send_booking_confirmation_email(booking_id, user_email, listing_title):
+def send_booking_confirmation_email(
+    booking_id, user_email, listing_title, template="confirmed"
+):
     """
-    Send a booking confirmation email to the user.
+    Send a booking email to the user.
+    template is "received" when the booking is created and "confirmed"
+    once its payment has been verified.
     """
-    subject = f"Booking Confirmation - {listing_title}"
-    message = f"""
+    if template == "received":
+        subject = f"Booking Received - {listing_title}"
+        message = f"""
+    Thank you for your booking!
+    
+    We have received your booking (ID: {booking_id}) for {listing_title}.
+    It will be confirmed once your payment is complete.
+    
+    Thank you for choosing our service!
+    """
+    else:
+        subject = f"Booking Confirmation - {listing_title}"
+        message = f"""
     Thank you for your booking!
     
     Your booking (ID: {booking_id}) for {listing_title} has been confirmed.
@@ -25,4 +68,204 @@ def send_booking_confirmation_email(booking_id, user_email, listing_title):
         fail_silently=False,
     )
 
-    return f"Confirmation email sent for booking {booking_id}"
+    return f"{template.capitalize()} email sent for booking {booking_id}"
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=30)
+def initiate_chapa_payment(
+    self, payment_id, callback_url, user_email, first_name, last_name, amount
+):
+    """
+    Initiate a Chapa transaction for a payment and store its checkout link.
+    Retried when Chapa cannot be reached; the payment is marked as failed
+    once Chapa rejects it or the retries run out.
+    """
+    session = get_chapa_session()
+    if session is None:
+        return "Chapa secret key not configured."
+
+    try:
+        transaction_id, checkout_url = initialize_transaction(
+            session,
+            tx_ref=payment_id,
+            amount=amount,
+            email=user_email,
+            first_name=first_name,
+            last_name=last_name,
+            callback_url=callback_url,
+        )
+    except ChapaError as exc:
+        if (
+            isinstance(exc, ChapaUnavailable)
+            and self.request.retries < self.max_retries
+        ):
+            raise self.retry(exc=exc)
+        # A payment that already has a live checkout link from another
+        # attempt stays pending even if this duplicate is rejected
+        Payment.objects.filter(
+            pk=payment_id,
+            status=Payment.PaymentStatus.PENDING,
+            checkout_url__isnull=True,
+        ).update(
+            status=Payment.PaymentStatus.FAILED,
+            updated_at=timezone.now(),
+        )
+        return f"Payment {payment_id} failed to initiate: {exc}"
+
+    Payment.objects.filter(
+        pk=payment_id, status=Payment.PaymentStatus.PENDING
+    ).update(
+        transaction_id=transaction_id,
+        checkout_url=checkout_url,
+        updated_at=timezone.now(),
+    )
+
+    return f"Chapa payment initiated for payment {payment_id}"
+
+
+def confirm_payment(payment):
+    """
+    Mark a payment as completed and its booking as confirmed.
+    Only the caller that moves the payment to completed confirms the
+    booking and sends the email, so duplicate callbacks are harmless.
+    """
+    booking = payment.booking
+    with transaction.atomic():
+        updated = (
+            Payment.objects.filter(pk=payment.pk)
+            .exclude(status=Payment.PaymentStatus.COMPLETED)
+            .update(
+                status=Payment.PaymentStatus.COMPLETED,
+                updated_at=timezone.now(),
+            )
+        )
+        if updated:
+            Booking.objects.filter(pk=booking.pk).update(
+                status=Booking.BookingStatus.CONFIRMED
+            )
+            transaction.on_commit(
+                lambda: send_booking_confirmation_email.delay(
+                    booking_id=str(booking.booking_id),
+                    user_email=booking.user.email,
+                    listing_title=booking.property.name,
+                    template="confirmed",
+                )
+            )
+
+
+def fail_payment(payment):
+    """
+    Mark a pending payment as failed.
+    The conditional update never overwrites a payment that another
+    callback or the poller has meanwhile completed.
+    """
+    Payment.objects.filter(
+        pk=payment.pk, status=Payment.PaymentStatus.PENDING
+    ).update(
+        status=Payment.PaymentStatus.FAILED,
+        updated_at=timezone.now(),
+    )
+
+
+def apply_verify_result(payment, res_data):
+    """
+    Confirm a payment if Chapa's verify response reports it as successful
+    for this payment's reference and amount.
+    Returns True when the payment was confirmed.
+    """
+    # Chapa sends "data": null on failures
+    details = res_data.get("data") or {}
+    if not isinstance(details, dict) or details.get("status") != "successful":
+        return False
+
+    # The transaction must belong to this payment and cover its amount
+    if details.get("tx_ref") != str(payment.payment_id):
+        return False
+    try:
+        amount = Decimal(str(details.get("amount")))
+    except InvalidOperation:
+        return False
+    if amount != payment.amount:
+        return False
+
+    confirm_payment(payment)
+    return True
+
+
+@shared_task(
+    soft_time_limit=POLL_SOFT_TIME_LIMIT, time_limit=POLL_SOFT_TIME_LIMIT + 30
+)
+def poll_pending_payments():
+    """
+    Verify pending payments with Chapa, recovering dropped callbacks.
+    Payments older than PENDING_PAYMENT_MAX_AGE get a final verify and are
+    expired unless paid, and payments whose verification keeps being
+    rejected are failed after MAX_VERIFY_RETRIES attempts.
+    """
+    session = get_chapa_session()
+    if session is None:
+        return "Chapa secret key not configured."
+
+    cutoff = timezone.now() - PENDING_PAYMENT_MAX_AGE
+    # Without a transaction id there is nothing to verify with Chapa
+    expired = Payment.objects.filter(
+        status=Payment.PaymentStatus.PENDING,
+        transaction_id__isnull=True,
+        created_at__lt=cutoff,
+    ).update(status=Payment.PaymentStatus.FAILED, updated_at=timezone.now())
+
+    # Oldest first, so payments due to expire are not starved by new ones
+    payments = (
+        Payment.objects.filter(
+            status=Payment.PaymentStatus.PENDING, transaction_id__isnull=False
+        )
+        .select_related("booking__user", "booking__property")
+        .order_by("created_at")[:PENDING_PAYMENT_BATCH_SIZE]
+    )
+
+    confirmed = 0
+    checked = 0
+    try:
+        for payment in payments:
+            stale = payment.created_at < cutoff
+            try:
+                res_data = verify_transaction(session, payment.transaction_id)
+            except ChapaUnavailable:
+                # An outage says nothing about the payment; leave the rest
+                # of the batch for the next run
+                break
+            except ChapaError:
+                checked += 1
+                if stale:
+                    fail_payment(payment)
+                    expired += 1
+                    continue
+                # Only rejected verifies count as retries; a payment Chapa
+                # still reports as unpaid waits until it expires
+                retry_count = payment.retry_count + 1
+                updates = {
+                    "retry_count": retry_count,
+                    "updated_at": timezone.now(),
+                }
+                if retry_count >= MAX_VERIFY_RETRIES:
+                    updates["status"] = Payment.PaymentStatus.FAILED
+                Payment.objects.filter(
+                    pk=payment.pk, status=Payment.PaymentStatus.PENDING
+                ).update(**updates)
+                continue
+
+            checked += 1
+            if apply_verify_result(payment, res_data):
+                confirmed += 1
+            elif stale:
+                fail_payment(payment)
+                expired += 1
+    except SoftTimeLimitExceeded:
+        # Stop before the next scheduled run starts; every update above is
+        # already committed, so the next run picks up where this one ended
+        pass
+
+    return (
+        f"Confirmed {confirmed} of {checked} pending payments checked, "
+        f"expired {expired}"
+    )
@@ -1,3 +1,874 @@
-from django.test import TestCase
+import hashlib
+import hmac
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import orjson
+import requests
+import urllib3
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import chapa
+from .tasks import (
+    MAX_VERIFY_RETRIES,
+    POLL_SOFT_TIME_LIMIT,
+    confirm_payment,
+    fail_payment,
+    initiate_chapa_payment,
+    poll_pending_payments,
+)
+from .chapa import (
+    CHAPA_MAX_RESPONSE_BYTES,
+    ChapaError,
+    ChapaResponseTooLarge,
+    ChapaUnavailable,
+    initialize_transaction,
+    is_valid_signature,
+    verify_transaction,
+)
+from .models import Booking, Listing, Payment, Review
+
+User = get_user_model()
+
+WEBHOOK_SECRET = "webhook-secret"
+
+
+def sign(body):
+    return hmac.new(
+        WEBHOOK_SECRET.encode(), body, hashlib.sha256
+    ).hexdigest()
+
+
+def verify_response(payment, chapa_status="successful"):
+    """Build a Chapa verify response body for a payment."""
+    return {
+        "data": {
+            "status": chapa_status,
+            "tx_ref": str(payment.payment_id),
+            "amount": str(payment.amount),
+        }
+    }
+
+
+def chapa_session(body=b"{}", status_code=200, read_error=None):
+    """Build a session mock whose GET/POST return a streamed response."""
+    response = mock.MagicMock(status_code=status_code)
+    response.__enter__.return_value = response
+    if read_error is not None:
+        response.raw.read.side_effect = read_error
+    else:
+        response.raw.read.side_effect = lambda amt, **kwargs: body[:amt]
+    session = mock.Mock()
+    session.get.return_value = response
+    session.post.return_value = response
+    return session
+
+
+class PaymentTestCase(TestCase):
+    def setUp(self):
+        self.host = User.objects.create_user(
+            username="host", email="host@example.com", password="password"
+        )
+        self.guest = User.objects.create_user(
+            username="guest", email="guest@example.com", password="password"
+        )
+        self.listing = Listing.objects.create(
+            host=self.host,
+            name="Lake House",
+            description="A house by the lake",
+            location="Bahir Dar",
+            price_per_night=Decimal("100.00"),
+        )
+        self.booking = Booking.objects.create(
+            property=self.listing,
+            user=self.guest,
+            start_date=date(2026, 1, 1),
+            end_date=date(2026, 1, 3),
+            total_price=Decimal("200.00"),
+        )
+        self.payment = Payment.objects.create(
+            booking=self.booking,
+            amount=self.booking.total_price,
+            transaction_id="chapa-tx-1",
+        )
+
+
+class IsValidSignatureTests(TestCase):
+    def test_valid_signature(self):
+        body = b'{"tx_ref": "abc"}'
+        with mock.patch.object(chapa, "_CHAPA_WEBHOOK_SECRET", WEBHOOK_SECRET):
+            self.assertTrue(is_valid_signature(body, sign(body)))
+
+    def test_tampered_body(self):
+        body = b'{"tx_ref": "abc"}'
+        with mock.patch.object(chapa, "_CHAPA_WEBHOOK_SECRET", WEBHOOK_SECRET):
+            self.assertFalse(
+                is_valid_signature(b'{"tx_ref": "xyz"}', sign(body))
+            )
+
+    def test_missing_secret(self):
+        body = b'{"tx_ref": "abc"}'
+        with mock.patch.object(chapa, "_CHAPA_WEBHOOK_SECRET", None):
+            self.assertFalse(is_valid_signature(body, sign(body)))
+
+    def test_missing_signature(self):
+        with mock.patch.object(chapa, "_CHAPA_WEBHOOK_SECRET", WEBHOOK_SECRET):
+            self.assertFalse(is_valid_signature(b"{}", None))
+
+
+@mock.patch(
+    "alx_travel_app.listings.views.get_chapa_session",
+    return_value=mock.Mock(),
+)
+@mock.patch(
+    "alx_travel_app.listings.tasks.send_booking_confirmation_email.delay"
+)
+class VerifyPaymentAPIViewTests(PaymentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.url = reverse("verify-payment")
+
+    def post_webhook(self, payload, signature=None):
+        body = orjson.dumps(payload)
+        headers = {}
+        if signature is not None:
+            headers["HTTP_CHAPA_SIGNATURE"] = signature
+        return self.client.post(
+            self.url, body, content_type="application/json", **headers
+        )
+
+    def test_signed_webhook_confirms_without_calling_chapa(
+        self, send_email, get_session
+    ):
+        payload = {
+            "tx_ref": str(self.payment.payment_id),
+            "reference": "chapa-tx-1",
+            "status": "success",
+        }
+        with mock.patch.object(
+            chapa, "_CHAPA_WEBHOOK_SECRET", WEBHOOK_SECRET
+        ), mock.patch(
+            "alx_travel_app.listings.views.verify_transaction"
+        ) as verify, self.captureOnCommitCallbacks(execute=True):
+            response = self.post_webhook(
+                payload, signature=sign(orjson.dumps(payload))
+            )
+
+        self.assertEqual(response.status_code, 200)
+        verify.assert_not_called()
+        self.payment.refresh_from_db()
+        self.booking.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.PaymentStatus.COMPLETED)
+        self.assertEqual(self.booking.status, Booking.BookingStatus.CONFIRMED)
+        send_email.assert_called_once()
+
+    def test_invalid_signature_falls_back_to_verify(
+        self, send_email, get_session
+    ):
+        payload = {
+            "tx_ref": str(self.payment.payment_id),
+            "reference": "chapa-tx-1",
+            "status": "success",
+        }
+        with mock.patch.object(
+            chapa, "_CHAPA_WEBHOOK_SECRET", WEBHOOK_SECRET
+        ), mock.patch(
+            "alx_travel_app.listings.views.verify_transaction",
+            return_value=verify_response(self.payment, "pending"),
+        ) as verify:
+            response = self.post_webhook(payload, signature="forged")
+
+        self.assertEqual(response.status_code, 400)
+        verify.assert_called_once()
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.PaymentStatus.FAILED)
+
+    def test_duplicate_callbacks_send_one_email(self, send_email, get_session):
+        params = {
+            "transaction_id": "chapa-tx-1",
+            "tx_ref": str(self.payment.payment_id),
+        }
+        with mock.patch(
+            "alx_travel_app.listings.views.verify_transaction",
+            return_value=verify_response(self.payment),
+        ), self.captureOnCommitCallbacks(execute=True):
+            first = self.client.get(self.url, params)
+            second = self.client.get(self.url, params)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        send_email.assert_called_once()
+        self.assertEqual(
+            send_email.call_args.kwargs["template"], "confirmed"
+        )
+
+
+@mock.patch(
+    "alx_travel_app.listings.tasks.send_booking_confirmation_email.delay"
+)
+class ConfirmPaymentTests(PaymentTestCase):
+    def test_concurrent_confirmations_send_one_email(self, send_email):
+        # Two callbacks holding stale copies of the same pending payment
+        first = Payment.objects.get(pk=self.payment.pk)
+        second = Payment.objects.get(pk=self.payment.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            confirm_payment(first)
+            confirm_payment(second)
+
+        send_email.assert_called_once()
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.status, Booking.BookingStatus.CONFIRMED)
+
+    def test_fail_does_not_overwrite_completed(self, send_email):
+        stale = Payment.objects.get(pk=self.payment.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            confirm_payment(self.payment)
+        fail_payment(stale)
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.PaymentStatus.COMPLETED)
+
+
+class ChapaResponseReadTests(TestCase):
+    def test_body_within_cap_is_parsed(self):
+        session = chapa_session(b'{"data": {"status": "successful"}}')
+        res_data = verify_transaction(session, "chapa-tx-1")
+        self.assertEqual(res_data["data"]["status"], "successful")
+
+    def test_body_over_cap_is_rejected(self):
+        body = b'{"pad": "' + b"x" * CHAPA_MAX_RESPONSE_BYTES + b'"}'
+        with self.assertRaises(ChapaResponseTooLarge):
+            verify_transaction(chapa_session(body), "chapa-tx-1")
+
+    def test_oversized_body_is_an_upstream_fault(self):
+        self.assertTrue(issubclass(ChapaResponseTooLarge, ChapaUnavailable))
+
+    def test_stalled_body_is_wrapped(self):
+        session = chapa_session(
+            read_error=urllib3.exceptions.ReadTimeoutError(None, "", "stall")
+        )
+        with self.assertRaises(ChapaUnavailable):
+            verify_transaction(session, "chapa-tx-1")
+
+    def test_broken_body_is_wrapped(self):
+        session = chapa_session(
+            read_error=urllib3.exceptions.ProtocolError("connection reset")
+        )
+        with self.assertRaises(ChapaUnavailable):
+            verify_transaction(session, "chapa-tx-1")
+
+
+class ChapaNetworkFailureTests(PaymentTestCase):
+    def test_request_errors_are_wrapped(self):
+        for error in (
+            requests.exceptions.RetryError("503"),
+            requests.exceptions.Timeout("timeout"),
+            requests.exceptions.ConnectionError("refused"),
+        ):
+            session = mock.Mock()
+            session.get.side_effect = error
+            session.post.side_effect = error
+            with self.assertRaises(ChapaUnavailable):
+                verify_transaction(session, "chapa-tx-1")
+            with self.assertRaises(ChapaUnavailable):
+                initialize_transaction(
+                    session,
+                    tx_ref="ref",
+                    amount="1.00",
+                    email="guest@example.com",
+                    first_name="",
+                    last_name="",
+                    callback_url="http://testserver/api/payments/verify/",
+                )
+
+    @override_settings(CHAPA_ASYNC_INITIATE=False)
+    def test_initiate_returns_502_when_chapa_is_unreachable(self):
+        client = APIClient()
+        client.force_authenticate(self.guest)
+        with mock.patch(
+            "alx_travel_app.listings.views.get_chapa_session",
+            return_value=mock.Mock(),
+        ), mock.patch(
+            "alx_travel_app.listings.views.initialize_transaction",
+            side_effect=ChapaUnavailable("Could not reach Chapa."),
+        ):
+            response = client.post(
+                reverse("initiate-payment"),
+                {"booking_id": str(self.booking.booking_id)},
+            )
+
+        self.assertEqual(response.status_code, 502)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.PaymentStatus.PENDING)
+
+    def test_verify_returns_502_and_keeps_payment_pending(self):
+        with mock.patch(
+            "alx_travel_app.listings.views.get_chapa_session",
+            return_value=mock.Mock(),
+        ), mock.patch(
+            "alx_travel_app.listings.views.verify_transaction",
+            side_effect=ChapaUnavailable("Could not reach Chapa."),
+        ):
+            response = APIClient().get(
+                reverse("verify-payment"),
+                {
+                    "transaction_id": "chapa-tx-1",
+                    "tx_ref": str(self.payment.payment_id),
+                },
+            )
+
+        self.assertEqual(response.status_code, 502)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.PaymentStatus.PENDING)
+
+
+@override_settings(CHAPA_ASYNC_INITIATE=False)
+@mock.patch(
+    "alx_travel_app.listings.views.get_chapa_session",
+    return_value=mock.Mock(),
+)
+class InlineInitiatePaymentTests(PaymentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.guest)
+        self.url = reverse("initiate-payment")
+        self.new_booking = Booking.objects.create(
+            property=self.listing,
+            user=self.guest,
+            start_date=date(2026, 2, 1),
+            end_date=date(2026, 2, 2),
+            total_price=Decimal("100.00"),
+        )
+
+    def initiate(self, booking, **patch_kwargs):
+        with mock.patch(
+            "alx_travel_app.listings.views.initialize_transaction",
+            **patch_kwargs,
+        ) as initialize:
+            response = self.client.post(
+                self.url, {"booking_id": str(booking.booking_id)}
+            )
+        return response, initialize
+
+    def test_new_payment_is_written_after_chapa_accepts(self, get_session):
+        response, initialize = self.initiate(
+            self.new_booking,
+            return_value=("chapa-tx-2", "https://checkout.chapa.co/2"),
+        )
+
+        self.assertEqual(response.status_code, 200)
+        payment = Payment.objects.get(booking=self.new_booking)
+        self.assertEqual(str(payment.payment_id), response.data["payment_id"])
+        self.assertEqual(
+            initialize.call_args.kwargs["tx_ref"], payment.payment_id
+        )
+        self.assertEqual(payment.checkout_url, "https://checkout.chapa.co/2")
+
+    def test_rejected_initiation_writes_nothing(self, get_session):
+        response, _ = self.initiate(
+            self.new_booking, side_effect=ChapaError("Rejected.")
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(
+            Payment.objects.filter(booking=self.new_booking).exists()
+        )
+
+    def test_reinitiation_after_reprice_updates_amount(self, get_session):
+        Payment.objects.filter(pk=self.payment.pk).update(
+            status=Payment.PaymentStatus.FAILED
+        )
+        Booking.objects.filter(pk=self.booking.pk).update(
+            total_price=Decimal("250.00")
+        )
+
+        response, initialize = self.initiate(
+            self.booking,
+            return_value=("chapa-tx-3", "https://checkout.chapa.co/3"),
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            initialize.call_args.kwargs["amount"], Decimal("250.00")
+        )
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.amount, Decimal("250.00"))
+        self.assertEqual(self.payment.status, Payment.PaymentStatus.PENDING)
+
+    def test_concurrent_creation_returns_existing_payment(self, get_session):
+        def concurrent_initiation(session, **kwargs):
+            Payment.objects.create(
+                booking=self.new_booking,
+                amount=self.new_booking.total_price,
+                transaction_id="chapa-tx-other",
+                checkout_url="https://checkout.chapa.co/other",
+            )
+            return "chapa-tx-4", "https://checkout.chapa.co/4"
+
+        response, _ = self.initiate(
+            self.new_booking, side_effect=concurrent_initiation
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data["payment_link"], "https://checkout.chapa.co/other"
+        )
+        self.assertEqual(
+            Payment.objects.filter(booking=self.new_booking).count(), 1
+        )
+
+    def test_concurrent_creation_without_link_conflicts(self, get_session):
+        def concurrent_initiation(session, **kwargs):
+            Payment.objects.create(
+                booking=self.new_booking, amount=self.new_booking.total_price
+            )
+            return "chapa-tx-5", "https://checkout.chapa.co/5"
+
+        response, _ = self.initiate(
+            self.new_booking, side_effect=concurrent_initiation
+        )
+
+        self.assertEqual(response.status_code, 409)
+
+
+@override_settings(CHAPA_ASYNC_INITIATE=True)
+@mock.patch("alx_travel_app.listings.views.initiate_chapa_payment.delay")
+@mock.patch(
+    "alx_travel_app.listings.views.get_chapa_session",
+    return_value=mock.Mock(),
+)
+class AsyncInitiatePaymentTests(PaymentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.guest)
+        self.url = reverse("initiate-payment")
+
+    def initiate(self):
+        return self.client.post(
+            self.url, {"booking_id": str(self.booking.booking_id)}
+        )
+
+    def test_initiation_is_queued(self, get_session, delay):
+        response = self.initiate()
+
+        self.assertEqual(response.status_code, 202)
+        self.assertNotIn("payment_link", response.data)
+        delay.assert_called_once()
+        self.assertEqual(
+            delay.call_args.kwargs["payment_id"], str(self.payment.payment_id)
+        )
+
+    def test_repeated_request_reuses_live_link(self, get_session, delay):
+        Payment.objects.filter(pk=self.payment.pk).update(
+            checkout_url="https://checkout.chapa.co/1"
+        )
+
+        response = self.initiate()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data["payment_link"], "https://checkout.chapa.co/1"
+        )
+        delay.assert_not_called()
+
+    def test_completed_payment_is_refused(self, get_session, delay):
+        Payment.objects.filter(pk=self.payment.pk).update(
+            status=Payment.PaymentStatus.COMPLETED
+        )
+
+        response = self.initiate()
+
+        self.assertEqual(response.status_code, 400)
+        delay.assert_not_called()
+
+    def test_reinitiation_after_reprice_updates_amount(
+        self, get_session, delay
+    ):
+        Payment.objects.filter(pk=self.payment.pk).update(
+            status=Payment.PaymentStatus.FAILED,
+            checkout_url="https://checkout.chapa.co/old",
+        )
+        Booking.objects.filter(pk=self.booking.pk).update(
+            total_price=Decimal("250.00")
+        )
+
+        response = self.initiate()
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(delay.call_args.kwargs["amount"], "250.00")
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.amount, Decimal("250.00"))
+        self.assertEqual(self.payment.status, Payment.PaymentStatus.PENDING)
+        self.assertIsNone(self.payment.checkout_url)
+
+
+@mock.patch(
+    "alx_travel_app.listings.tasks.get_chapa_session",
+    return_value=mock.Mock(),
+)
+class InitiateChapaPaymentTaskTests(PaymentTestCase):
+    def run_task(self, **patch_kwargs):
+        with mock.patch(
+            "alx_travel_app.listings.tasks.initialize_transaction",
+            **patch_kwargs,
+        ) as initialize:
+            initiate_chapa_payment.apply(
+                kwargs={
+                    "payment_id": str(self.payment.payment_id),
+                    "callback_url": "http://testserver/api/payments/verify/",
+                    "user_email": self.guest.email,
+                    "first_name": "",
+                    "last_name": "",
+                    "amount": str(self.payment.amount),
+                }
+            )
+        self.payment.refresh_from_db()
+        return initialize
+
+    def test_link_is_stored(self, get_session):
+        self.run_task(
+            return_value=("chapa-tx-9", "https://checkout.chapa.co/9")
+        )
+
+        self.assertEqual(self.payment.transaction_id, "chapa-tx-9")
+        self.assertEqual(
+            self.payment.checkout_url, "https://checkout.chapa.co/9"
+        )
+
+    def test_rejection_fails_payment(self, get_session):
+        self.run_task(side_effect=ChapaError("Rejected."))
+
+        self.assertEqual(self.payment.status, Payment.PaymentStatus.FAILED)
+
+    def test_duplicate_rejection_keeps_live_link(self, get_session):
+        Payment.objects.filter(pk=self.payment.pk).update(
+            checkout_url="https://checkout.chapa.co/1"
+        )
+
+        self.run_task(side_effect=ChapaError("Duplicate tx_ref."))
+
+        self.assertEqual(self.payment.status, Payment.PaymentStatus.PENDING)
+
+    def test_unreachable_chapa_is_retried_then_failed(self, get_session):
+        initialize = self.run_task(
+            side_effect=ChapaUnavailable("Could not reach Chapa.")
+        )
+
+        self.assertEqual(
+            initialize.call_count, initiate_chapa_payment.max_retries + 1
+        )
+        self.assertEqual(self.payment.status, Payment.PaymentStatus.FAILED)
+
+    def test_completed_payment_is_not_failed(self, get_session):
+        Payment.objects.filter(pk=self.payment.pk).update(
+            status=Payment.PaymentStatus.COMPLETED
+        )
+
+        self.run_task(side_effect=ChapaError("Rejected."))
+
+        self.assertEqual(
+            self.payment.status, Payment.PaymentStatus.COMPLETED
+        )
+
+
+class PaymentLinkAPIViewTests(PaymentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.guest)
+        self.url = reverse(
+            "payment-link", kwargs={"payment_id": self.payment.payment_id}
+        )
+
+    def test_pending_without_link_is_accepted(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 202)
+        self.assertNotIn("payment_link", response.data)
+
+    def test_pending_with_link_returns_it(self):
+        Payment.objects.filter(pk=self.payment.pk).update(
+            checkout_url="https://checkout.chapa.co/1"
+        )
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data["payment_link"], "https://checkout.chapa.co/1"
+        )
+
+    def test_failed_payment_hides_stale_link(self):
+        Payment.objects.filter(pk=self.payment.pk).update(
+            status=Payment.PaymentStatus.FAILED,
+            checkout_url="https://checkout.chapa.co/1",
+        )
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["status"], Payment.PaymentStatus.FAILED)
+        self.assertNotIn("payment_link", response.data)
+
+    def test_other_users_payment_is_not_found(self):
+        other = User.objects.create_user(username="other", password="password")
+        self.client.force_authenticate(other)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 404)
+
+
+@mock.patch(
+    "alx_travel_app.listings.views.get_chapa_session",
+    return_value=mock.Mock(),
+)
+class VerifyPaymentResultTests(PaymentTestCase):
+    def verify(self, **patch_kwargs):
+        with mock.patch(
+            "alx_travel_app.listings.views.verify_transaction",
+            **patch_kwargs,
+        ) as verify:
+            response = APIClient().get(
+                reverse("verify-payment"),
+                {
+                    "transaction_id": "chapa-tx-1",
+                    "tx_ref": str(self.payment.payment_id),
+                },
+            )
+        self.payment.refresh_from_db()
+        return response, verify
+
+    def test_completed_payment_skips_chapa(self, get_session):
+        Payment.objects.filter(pk=self.payment.pk).update(
+            status=Payment.PaymentStatus.COMPLETED
+        )
+
+        response, verify = self.verify()
+
+        self.assertEqual(response.status_code, 200)
+        verify.assert_not_called()
+
+    def test_success_for_another_payment_is_rejected(self, get_session):
+        other = verify_response(self.payment)
+        other["data"]["tx_ref"] = "another-payment"
+
+        response, _ = self.verify(return_value=other)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertNotEqual(
+            self.payment.status, Payment.PaymentStatus.COMPLETED
+        )
+
+    def test_success_for_another_amount_is_rejected(self, get_session):
+        other = verify_response(self.payment)
+        other["data"]["amount"] = "1.00"
+
+        response, _ = self.verify(return_value=other)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertNotEqual(
+            self.payment.status, Payment.PaymentStatus.COMPLETED
+        )
+
+    def test_null_data_is_unsuccessful(self, get_session):
+        response, _ = self.verify(return_value={"data": None})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.payment.status, Payment.PaymentStatus.FAILED)
+
+
+@mock.patch(
+    "alx_travel_app.listings.tasks.get_chapa_session",
+    return_value=mock.Mock(),
+)
+class PollPendingPaymentsTests(PaymentTestCase):
+    def make_stale(self):
+        Payment.objects.filter(pk=self.payment.pk).update(
+            created_at=timezone.now() - timedelta(days=3)
+        )
+
+    def test_verify_errors_count_as_retries_until_failed(self, get_session):
+        with mock.patch(
+            "alx_travel_app.listings.tasks.verify_transaction",
+            side_effect=ChapaError("rejected"),
+        ):
+            for attempt in range(1, MAX_VERIFY_RETRIES):
+                poll_pending_payments()
+                self.payment.refresh_from_db()
+                self.assertEqual(self.payment.retry_count, attempt)
+                self.assertEqual(
+                    self.payment.status, Payment.PaymentStatus.PENDING
+                )
+
+            poll_pending_payments()
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.PaymentStatus.FAILED)
+
+    def test_unavailable_is_not_a_retry(self, get_session):
+        with mock.patch(
+            "alx_travel_app.listings.tasks.verify_transaction",
+            side_effect=ChapaUnavailable("down"),
+        ):
+            for _ in range(MAX_VERIFY_RETRIES + 1):
+                poll_pending_payments()
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.retry_count, 0)
+        self.assertEqual(self.payment.status, Payment.PaymentStatus.PENDING)
+
+    def test_unavailable_stops_the_run(self, get_session):
+        booking = Booking.objects.create(
+            property=self.listing,
+            user=self.guest,
+            start_date=date(2026, 2, 1),
+            end_date=date(2026, 2, 3),
+            total_price=Decimal("200.00"),
+        )
+        second = Payment.objects.create(
+            booking=booking,
+            amount=booking.total_price,
+            transaction_id="chapa-tx-2",
+        )
+        with mock.patch(
+            "alx_travel_app.listings.tasks.verify_transaction",
+            side_effect=ChapaUnavailable("down"),
+        ) as verify:
+            poll_pending_payments()
+
+        verify.assert_called_once()
+        second.refresh_from_db()
+        self.assertEqual(second.status, Payment.PaymentStatus.PENDING)
+
+    def test_unpaid_payment_is_not_a_retry(self, get_session):
+        with mock.patch(
+            "alx_travel_app.listings.tasks.verify_transaction",
+            return_value=verify_response(self.payment, "pending"),
+        ):
+            for _ in range(MAX_VERIFY_RETRIES + 1):
+                poll_pending_payments()
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.retry_count, 0)
+        self.assertEqual(self.payment.status, Payment.PaymentStatus.PENDING)
+
+    def test_stale_unpaid_payment_is_expired(self, get_session):
+        self.make_stale()
+        with mock.patch(
+            "alx_travel_app.listings.tasks.verify_transaction",
+            return_value=verify_response(self.payment, "pending"),
+        ) as verify:
+            poll_pending_payments()
+
+        verify.assert_called_once()
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.PaymentStatus.FAILED)
+
+    def test_stale_paid_payment_is_confirmed(self, get_session):
+        self.make_stale()
+        with mock.patch(
+            "alx_travel_app.listings.tasks.verify_transaction",
+            return_value=verify_response(self.payment),
+        ), mock.patch(
+            "alx_travel_app.listings.tasks.send_booking_confirmation_email.delay"
+        ), self.captureOnCommitCallbacks(execute=True):
+            poll_pending_payments()
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.PaymentStatus.COMPLETED)
+
+    def test_stale_payment_is_kept_while_chapa_is_down(self, get_session):
+        self.make_stale()
+        with mock.patch(
+            "alx_travel_app.listings.tasks.verify_transaction",
+            side_effect=ChapaUnavailable("down"),
+        ):
+            poll_pending_payments()
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.PaymentStatus.PENDING)
+
+    def test_stale_payment_without_transaction_is_expired(self, get_session):
+        Payment.objects.filter(pk=self.payment.pk).update(transaction_id=None)
+        self.make_stale()
+        with mock.patch(
+            "alx_travel_app.listings.tasks.verify_transaction"
+        ) as verify:
+            poll_pending_payments()
+
+        verify.assert_not_called()
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.PaymentStatus.FAILED)
+
+    def test_successful_payment_is_confirmed(self, get_session):
+        with mock.patch(
+            "alx_travel_app.listings.tasks.verify_transaction",
+            return_value=verify_response(self.payment),
+        ), mock.patch(
+            "alx_travel_app.listings.tasks.send_booking_confirmation_email.delay"
+        ), self.captureOnCommitCallbacks(execute=True):
+            poll_pending_payments()
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.PaymentStatus.COMPLETED)
+
+    def test_soft_time_limit_ends_the_run(self, get_session):
+        with mock.patch(
+            "alx_travel_app.listings.tasks.verify_transaction",
+            side_effect=SoftTimeLimitExceeded(),
+        ):
+            result = poll_pending_payments()
+
+        self.assertIn("Confirmed 0 of 0", result)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.PaymentStatus.PENDING)
+
+    def test_runs_cannot_overlap(self, get_session):
+        interval = settings.CELERY_BEAT_SCHEDULE["poll-pending-payments"]
+        self.assertLess(
+            interval["options"]["expires"], interval["schedule"]
+        )
+        self.assertLess(poll_pending_payments.time_limit, interval["schedule"])
+        self.assertEqual(
+            poll_pending_payments.soft_time_limit, POLL_SOFT_TIME_LIMIT
+        )
+
+
+class ListingViewSetTests(TestCase):
+    def test_list_query_count_does_not_grow_with_listings(self):
+        host = User.objects.create_user(username="host", password="password")
+        for i in range(10):
+            listing = Listing.objects.create(
+                host=host,
+                name=f"Listing {i}",
+                description="Description",
+                location="Addis Ababa",
+                price_per_night=Decimal("50.00"),
+            )
+            reviewer = User.objects.create_user(
+                username=f"reviewer{i}", password="password"
+            )
+            Review.objects.create(
+                property=listing, user=reviewer, rating=5, comment="Great"
+            )
+
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get(reverse("listing-list"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 10)
+        # One query for the listings and one for their prefetched reviews
+        self.assertEqual(len(queries), 2)
@@ -5,6 +5,7 @@ from .views import (
     BookingViewSet,
     ReviewViewSet,
     InitiatePaymentAPIView,
+    PaymentLinkAPIView,
     VerifyPaymentAPIView,
 )
 
@@ -21,6 +22,11 @@ urlpatterns = [
         InitiatePaymentAPIView.as_view(),
         name="initiate-payment",
     ),
+    path(
+        "payments/<uuid:payment_id>/link/",
+        PaymentLinkAPIView.as_view(),
+        name="payment-link",
+    ),
     path(
         "payments/verify/",
         VerifyPaymentAPIView.as_view(),
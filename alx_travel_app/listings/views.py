@@ -1,11 +1,22 @@
-import os
-import requests
+import uuid
+import orjson
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from rest_framework import viewsets, permissions, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from drf_yasg.utils import swagger_auto_schema
 
+from .chapa import (
+    ChapaError,
+    ChapaUnavailable,
+    get_chapa_session,
+    initialize_transaction,
+    is_valid_signature,
+    verify_transaction,
+)
 from .models import Listing, Booking, Review, Payment
 from .serializers import (
     ListingSerializer,
@@ -13,15 +24,21 @@ from .serializers import (
     ReviewSerializer,
     PaymentSerializer,
 )
-from .tasks import send_booking_confirmation_email
-
+from .tasks import (
+    apply_verify_result,
+    confirm_payment,
+    fail_payment,
+    initiate_chapa_payment,
+    send_booking_confirmation_email,
+)
 
 class ListingViewSet(viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing property listings.
     """
 
-    queryset = Listing.objects.all()
+    # Reviews are nested in ListingSerializer; fetch them in one query
+    queryset = Listing.objects.prefetch_related("reviews")
     serializer_class = ListingSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
@@ -62,11 +79,13 @@ class BookingViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         booking = serializer.save(user=self.request.user)
-        # Send booking confirmation email asynchronously
+        # Let the user know the booking was received; the confirmation
+        # email follows once payment is verified
         send_booking_confirmation_email.delay(
-            booking_id=booking.id,
+            booking_id=str(booking.booking_id),
             user_email=booking.user.email,
-            listing_title=booking.listing.title,
+            listing_title=booking.property.name,
+            template="received",
         )
 
     @swagger_auto_schema(
@@ -108,10 +127,24 @@ class InitiatePaymentAPIView(APIView):
 
     @swagger_auto_schema(
         request_body=PaymentSerializer,
-        operation_description="Initiate payment for a booking",
-        responses={200: PaymentSerializer()},
+        operation_description=(
+            "Initiate payment for a booking. Returns the payment link, or "
+            "202 without it when CHAPA_ASYNC_INITIATE is enabled; the link "
+            "is then fetched from /api/payments/{payment_id}/link/"
+        ),
+        responses={
+            200: PaymentSerializer(),
+            202: "Payment initiation queued",
+        },
     )
     def post(self, request, *args, **kwargs):
+        session = get_chapa_session()
+        if session is None:
+            return Response(
+                {"error": "Chapa secret key not configured."},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+
         booking_id = request.data.get("booking_id")
         if not booking_id:
             return Response(
@@ -124,72 +157,193 @@ class InitiatePaymentAPIView(APIView):
             Booking, booking_id=booking_id, user=request.user
         )
 
-        # Create a Payment record (or get the existing one)
-        payment, created = Payment.objects.get_or_create(
-            booking=booking, defaults={"amount": booking.total_price}
-        )
-
-        # Prepare data for Chapa payment initiation
-        chapa_secret_key = os.environ.get("CHAPA_SECRET_KEY")
-        if not chapa_secret_key:
-            return Response(
-                {"error": "Chapa secret key not configured."},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            )
-
-        headers = {
-            "Authorization": f"Bearer {chapa_secret_key}",
-            "Content-Type": "application/json",
-        }
         # Build the callback URL so that Chapa redirects after payment
         callback_url = request.build_absolute_uri(
             "/api/payments/verify/"
         )  # adjust path if needed
 
-        # Data expected by Chapa – adjust fields as per Chapa API docs.
-        data = {
-            "amount": str(booking.total_price),
-            "currency": "ETB",  # Change this to your required currency
-            "email": request.user.email,
-            "first_name": request.user.first_name,
-            "last_name": getattr(request.user, "last_name", ""),
-            "tx_ref": str(
-                payment.payment_id
-            ),  # Use payment_id as transaction reference
-            "callback_url": callback_url,
-        }
+        if settings.CHAPA_ASYNC_INITIATE:
+            # The task and the link endpoint need the Payment record upfront
+            payment, created = Payment.objects.get_or_create(
+                booking=booking, defaults={"amount": booking.total_price}
+            )
+            if payment.status == Payment.PaymentStatus.COMPLETED:
+                return Response(
+                    {"error": "Payment already completed."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            if (
+                payment.status == Payment.PaymentStatus.PENDING
+                and payment.checkout_url
+            ):
+                # A repeated request (e.g. a double click) reuses the live
+                # checkout link instead of asking Chapa again
+                return Response(
+                    {
+                        "payment_id": str(payment.payment_id),
+                        "payment_link": payment.checkout_url,
+                        "status": payment.status,
+                    },
+                    status=status.HTTP_200_OK,
+                )
+            if not created:
+                # A retried failed payment starts over as pending, and the
+                # amount follows the booking in case it was repriced
+                Payment.objects.filter(pk=payment.pk).exclude(
+                    status=Payment.PaymentStatus.COMPLETED
+                ).update(
+                    status=Payment.PaymentStatus.PENDING,
+                    amount=booking.total_price,
+                    checkout_url=None,
+                    retry_count=0,
+                    updated_at=timezone.now(),
+                )
+                payment.status = Payment.PaymentStatus.PENDING
+            # Hand the Chapa call to Celery; the client fetches the link
+            # from the payment link endpoint once it is ready
+            initiate_chapa_payment.delay(
+                payment_id=str(payment.payment_id),
+                callback_url=callback_url,
+                user_email=request.user.email,
+                first_name=request.user.first_name,
+                last_name=getattr(request.user, "last_name", ""),
+                amount=str(booking.total_price),
+            )
+            return Response(
+                {
+                    "payment_id": str(payment.payment_id),
+                    "status": payment.status,
+                },
+                status=status.HTTP_202_ACCEPTED,
+            )
 
-        # Call Chapa API to initiate the payment
-        response = requests.post(
-            "https://api.chapa.co/v1/transaction/initialize",
-            json=data,
-            headers=headers,
+        # Reuse the reference of an earlier attempt for this booking, or
+        # generate one without writing the Payment until Chapa accepts it
+        existing_payment = (
+            Payment.objects.filter(booking=booking)
+            .values_list("payment_id", "status")
+            .first()
+        )
+        payment_id, payment_status = existing_payment or (
+            uuid.uuid4(),
+            Payment.PaymentStatus.PENDING,
         )
-        if response.status_code != 200:
+        if payment_status == Payment.PaymentStatus.COMPLETED:
             return Response(
-                {"error": "Failed to initiate payment with Chapa."},
+                {"error": "Payment already completed."},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        res_data = response.json()
-        # Extract transaction details (adjust keys based on Chapa’s response)
-        transaction_id = res_data.get("data", {}).get("transaction_id")
-        payment_link = res_data.get("data", {}).get("checkout_url")
-        if not transaction_id or not payment_link:
+        # Call Chapa API to initiate the payment
+        try:
+            transaction_id, payment_link = initialize_transaction(
+                session,
+                tx_ref=payment_id,
+                amount=booking.total_price,
+                email=request.user.email,
+                first_name=request.user.first_name,
+                last_name=getattr(request.user, "last_name", ""),
+                callback_url=callback_url,
+            )
+        except ChapaUnavailable as exc:
             return Response(
-                {"error": "Invalid response from Chapa."},
+                {"error": str(exc)},
+                status=status.HTTP_502_BAD_GATEWAY,
+            )
+        except ChapaError as exc:
+            return Response(
+                {"error": str(exc)},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        # Save the transaction_id in our Payment record
-        payment.transaction_id = transaction_id
-        payment.save()
+        # Save the transaction details in our Payment record
+        if existing_payment:
+            # A retried failed payment starts over as pending, and the
+            # amount follows the booking in case it was repriced
+            Payment.objects.filter(pk=payment_id).exclude(
+                status=Payment.PaymentStatus.COMPLETED
+            ).update(
+                amount=booking.total_price,
+                transaction_id=transaction_id,
+                checkout_url=payment_link,
+                status=Payment.PaymentStatus.PENDING,
+                retry_count=0,
+                updated_at=timezone.now(),
+            )
+        else:
+            try:
+                with transaction.atomic():
+                    Payment.objects.create(
+                        payment_id=payment_id,
+                        booking=booking,
+                        amount=booking.total_price,
+                        transaction_id=transaction_id,
+                        checkout_url=payment_link,
+                    )
+            except IntegrityError:
+                # A concurrent request created this booking's payment while
+                # we waited on Chapa; hand back that payment instead
+                payment = Payment.objects.get(booking=booking)
+                if not payment.checkout_url:
+                    return Response(
+                        {"error": "Payment initiation already in progress."},
+                        status=status.HTTP_409_CONFLICT,
+                    )
+                return Response(
+                    {
+                        "payment_id": str(payment.payment_id),
+                        "payment_link": payment.checkout_url,
+                        "status": payment.status,
+                    },
+                    status=status.HTTP_200_OK,
+                )
 
         # Return the payment link and payment details to the client
         return Response(
             {
-                "payment_id": str(payment.payment_id),
+                "payment_id": str(payment_id),
                 "payment_link": payment_link,
+                "status": Payment.PaymentStatus.PENDING,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class PaymentLinkAPIView(APIView):
+    """
+    API endpoint to fetch the Chapa checkout link for a payment.
+    Returns 202 while the link is still being requested from Chapa.
+    Completed and failed payments are returned without a link.
+    """
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, payment_id, *args, **kwargs):
+        payment = get_object_or_404(
+            Payment, payment_id=payment_id, booking__user=request.user
+        )
+        if payment.status != Payment.PaymentStatus.PENDING:
+            return Response(
+                {
+                    "payment_id": str(payment.payment_id),
+                    "status": payment.status,
+                },
+                status=status.HTTP_200_OK,
+            )
+
+        if not payment.checkout_url:
+            return Response(
+                {
+                    "payment_id": str(payment.payment_id),
+                    "status": payment.status,
+                },
+                status=status.HTTP_202_ACCEPTED,
+            )
+
+        return Response(
+            {
+                "payment_id": str(payment.payment_id),
+                "payment_link": payment.checkout_url,
                 "status": payment.status,
             },
             status=status.HTTP_200_OK,
@@ -200,67 +354,113 @@ class VerifyPaymentAPIView(APIView):
     """
     API endpoint to verify a payment with Chapa.
     This could be the endpoint used as the callback URL.
-    Expects query parameters 'transaction_id' and 'tx_ref' (payment_id).
+    GET expects query parameters 'transaction_id' and 'tx_ref' (payment_id).
+    POST accepts Chapa webhooks; a validly signed success event confirms
+    the payment without calling Chapa's verify endpoint.
     """
 
     permission_classes = [permissions.AllowAny]
 
     def get(self, request, *args, **kwargs):
-        transaction_id = request.query_params.get("transaction_id")
-        tx_ref = request.query_params.get("tx_ref")
+        session = get_chapa_session()
+        if session is None:
+            return Response(
+                {"error": "Chapa secret key not configured."},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
 
-        if not transaction_id or not tx_ref:
+        return self.verify_payment(
+            session,
+            transaction_id=request.query_params.get("transaction_id"),
+            tx_ref=request.query_params.get("tx_ref"),
+        )
+
+    def post(self, request, *args, **kwargs):
+        session = get_chapa_session()
+        if session is None:
             return Response(
-                {"error": "Missing transaction_id or tx_ref parameter."},
-                status=status.HTTP_400_BAD_REQUEST,
+                {"error": "Chapa secret key not configured."},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
 
+        # The signature covers the raw body, so read it before parsing
+        body = request.body
+        signed = is_valid_signature(
+            body, request.headers.get("Chapa-Signature")
+        )
         try:
-            payment = Payment.objects.get(payment_id=tx_ref)
-        except Payment.DoesNotExist:
+            payload = orjson.loads(body)
+        except orjson.JSONDecodeError:
+            payload = None
+        if not isinstance(payload, dict):
             return Response(
-                {"error": "Payment record not found."},
-                status=status.HTTP_404_NOT_FOUND,
+                {"error": "Invalid webhook payload."},
+                status=status.HTTP_400_BAD_REQUEST,
             )
 
-        chapa_secret_key = os.environ.get("CHAPA_SECRET_KEY")
-        headers = {
-            "Authorization": f"Bearer {chapa_secret_key}",
-            "Content-Type": "application/json",
-        }
-        verify_url = (
-            f"https://api.chapa.co/v1/transaction/verify/{transaction_id}"
+        return self.verify_payment(
+            session,
+            transaction_id=payload.get("reference"),
+            tx_ref=payload.get("tx_ref"),
+            confirmed=signed and payload.get("status") == "success",
         )
-        response = requests.get(verify_url, headers=headers)
-        if response.status_code != 200:
-            payment.status = Payment.PaymentStatus.FAILED
-            payment.save()
+
+    def verify_payment(self, session, transaction_id, tx_ref, confirmed=False):
+        """
+        Confirm or fail the payment referenced by tx_ref.
+        Chapa's verify endpoint is only called when the result has not
+        already been confirmed by a signed webhook.
+        """
+        if not transaction_id or not tx_ref:
             return Response(
-                {"error": "Payment verification failed with Chapa."},
+                {"error": "Missing transaction_id or tx_ref parameter."},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        res_data = response.json()
-        chapa_status = res_data.get("data", {}).get("status")
-        if chapa_status == "successful":
-            payment.status = Payment.PaymentStatus.COMPLETED
-            payment.save()
-            booking = payment.booking
-            booking.status = Booking.BookingStatus.CONFIRMED
-            booking.save()
-            send_booking_confirmation_email.delay(
-                booking_id=str(booking.booking_id),
-                user_email=booking.user.email,
-                listing_title=booking.property.name,
+        try:
+            payment = Payment.objects.select_related(
+                "booking__user", "booking__property"
+            ).get(payment_id=tx_ref)
+        except Payment.DoesNotExist:
+            return Response(
+                {"error": "Payment record not found."},
+                status=status.HTTP_404_NOT_FOUND,
             )
+
+        # A repeated callback for an already confirmed payment needs no
+        # round-trip to Chapa
+        if payment.status == Payment.PaymentStatus.COMPLETED:
             return Response(
                 {"message": "Payment verified and booking confirmed."},
                 status=status.HTTP_200_OK,
             )
+
+        if not confirmed:
+            try:
+                res_data = verify_transaction(session, transaction_id)
+            except ChapaUnavailable as exc:
+                # An upstream fault says nothing about the payment
+                return Response(
+                    {"error": str(exc)},
+                    status=status.HTTP_502_BAD_GATEWAY,
+                )
+            except ChapaError as exc:
+                fail_payment(payment)
+                return Response(
+                    {"error": str(exc)},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            if not apply_verify_result(payment, res_data):
+                fail_payment(payment)
+                return Response(
+                    {"message": "Payment verification unsuccessful."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
         else:
-            payment.status = Payment.PaymentStatus.FAILED
-            payment.save()
-            return Response(
-                {"message": "Payment verification unsuccessful."},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
+            confirm_payment(payment)
+
+        return Response(
+            {"message": "Payment verified and booking confirmed."},
+            status=status.HTTP_200_OK,
+        )
@@ -34,6 +34,7 @@ THIRD_PARTY_APPS = [
     "rest_framework",
     "drf_yasg",
     "corsheaders",
+    "django_celery_beat",
 ]
 
 LOCAL_APPS = [
@@ -174,6 +175,19 @@ CELERY_TIMEZONE = TIME_ZONE
 
 # Celery Beat Settings
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
+CELERY_BEAT_SCHEDULE = {
+    "poll-pending-payments": {
+        "task": "alx_travel_app.listings.tasks.poll_pending_payments",
+        "schedule": 300.0,  # every 5 minutes
+        # Drop runs queued behind a busy worker instead of stacking them up
+        "options": {"expires": 240},
+    },
+}
+
+# Chapa Configuration
+# When enabled, payment initiation is handed to Celery and the checkout
+# link is fetched from /api/payments/<payment_id>/link/
+CHAPA_ASYNC_INITIATE = env.bool("CHAPA_ASYNC_INITIATE", default=False)
 
 # Email Configuration
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'